@@ -59,7 +59,9 @@ True
 from calendar import timegm
 from datetime import date, datetime, time
 from decimal import Decimal
+import re
 from time import strptime, struct_time
+from weakref import WeakKeyDictionary
 
 from couchdb.design import ViewDefinition
 
@@ -70,6 +72,22 @@ __docformat__ = 'restructuredtext en'
 
 DEFAULT = object()
 
+# The exact formats produced by the `_to_json` methods of the date/time fields,
+# which can be parsed by slicing; anything else (including leap seconds) is
+# left to strptime
+_ISO_DATE = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}\Z')
+_ISO_DATETIME = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}T'
+                           r'[0-9]{2}:[0-9]{2}:[0-5][0-9]\Z')
+_ISO_TIME = re.compile(r'[0-9]{2}:[0-9]{2}:[0-9]{2}\Z')
+
+
+def _implementation(cls, name):
+    """Return the function implementing the named method of a class, or the
+    attribute itself if it is not a Python function (such as ``unicode``).
+    """
+    attr = getattr(cls, name)
+    return getattr(attr, 'im_func', attr)
+
 
 class Field(object):
     """Basic unit for mapping a piece of data between Python and JSON.
@@ -77,29 +95,50 @@ class Field(object):
     Instances of this class can be added to subclasses of `Document` to describe
     the schema of a document.
     """
+    __slots__ = ('name', 'default', '_py', '_json')
+
+    # The Python type for which both `_to_python` and `_to_json` are a no-op,
+    # so that values of exactly that type can be passed through as is
+    _python_type = None
+
+    # Whether converting values to Python is costly enough that the result
+    # should be cached on the schema instance
+    _cached = False
 
     def __init__(self, name=None, default=None):
+        if type(name) is str:
+            name = intern(name)
         self.name = name
         self.default = default
+        self._bind_converters()
 
     def __get__(self, instance, owner):
         if instance is None:
             return self
         value = instance._data.get(self.name)
         if value is not None:
-            value = self._to_python(value)
-        elif self.default is not None:
-            default = self.default
-            if callable(default):
-                default = default()
-            value = default
-        return value
+            if type(value) is self._python_type:
+                return value
+            return self._py(value)
+        default = self.default
+        if callable(default):
+            default = default()
+        return default
 
     def __set__(self, instance, value):
-        if value is not None:
-            value = self._to_json(value)
+        if value is not None and type(value) is not self._python_type:
+            value = self._json(value)
         instance._data[self.name] = value
 
+    def _bind_converters(self):
+        # Bind the conversion functions once, instead of on every access
+        self._py = self._to_python
+        if _implementation(type(self), '_to_json') is \
+                _implementation(Field, '_to_json'):
+            self._json = self._py
+        else:
+            self._json = self._to_json
+
     def _to_python(self, value):
         return unicode(value)
 
@@ -107,30 +146,182 @@ class Field(object):
         return self._to_python(value)
 
 
+class _RequiredField(object):
+    """Mixin for fields that have no default value, so that reading the field
+    can skip the default handling altogether.
+    """
+    __slots__ = ()
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance._data.get(self.name)
+        if value is not None and type(value) is not self._python_type:
+            value = self._py(value)
+        return value
+
+
+class _CachedField(object):
+    """Mixin for fields with costly conversions, which caches the converted
+    values on the schema instance until the field is assigned to again.
+    """
+    __slots__ = ()
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        cache = instance._cache
+        name = self.name
+        if name in cache:
+            return cache[name]
+        value = instance._data.get(name)
+        if value is not None:
+            value = cache[name] = self._py(value)
+            return value
+        default = self.default
+        if callable(default):
+            default = default()
+        return default
+
+    def __set__(self, instance, value):
+        instance._cache.pop(self.name, None)
+        Field.__set__(self, instance, value)
+
+_field_variants = {}
+
+def _field_variant(mixin, cls):
+    """Return the variant of the given field class that has the given mixin
+    applied.
+    """
+    try:
+        return _field_variants[mixin, cls]
+    except KeyError:
+        subcls = type(cls.__name__, (mixin, cls),
+                      {'__module__': cls.__module__, '__slots__': ()})
+        _field_variants[mixin, cls] = subcls
+        return subcls
+
+
 class SchemaMeta(type):
 
     def __new__(cls, name, bases, d):
-        fields = {}
-        for base in bases:
-            if hasattr(base, '_fields'):
-                fields.update(base._fields)
-        for attrname, attrval in d.items():
+        # The fields of a base class already include those it inherited, so
+        # only the direct bases need to be looked at
+        if len(bases) == 1:
+            fields = dict(getattr(bases[0], '_fields', ()))
+        else:
+            fields = {}
+            for base in bases:
+                fields.update(getattr(base, '_fields', ()))
+        for attrname, attrval in d.iteritems():
             if isinstance(attrval, Field):
                 if not attrval.name:
-                    attrval.name = attrname
+                    attrval.name = intern(attrname)
+                if not hasattr(attrval, '_json'):
+                    # Subclass that doesn't call `Field.__init__`
+                    attrval._bind_converters()
+                field_type = type(attrval)
+                if _implementation(field_type, '__get__') is \
+                        _implementation(Field, '__get__'):
+                    if attrval._cached and \
+                            _implementation(field_type, '__set__') is \
+                            _implementation(Field, '__set__'):
+                        attrval.__class__ = _field_variant(_CachedField,
+                                                           field_type)
+                    elif attrval.default is None:
+                        attrval.__class__ = _field_variant(_RequiredField,
+                                                           field_type)
                 fields[attrname] = attrval
         d['_fields'] = fields
+        items = []
+        generic = False
+        for attrname, field in fields.items():
+            # Values of the field's native type can bypass the descriptor on
+            # initialization, unless the field customizes how it is set
+            field_type = type(field)
+            python_type = None
+            if _implementation(field_type, '__set__') in _standard_setters:
+                python_type = field._python_type
+            else:
+                generic = True
+            if _implementation(field_type, '__get__') not in _standard_getters:
+                # The default value needs to be looked up through the field
+                generic = True
+            items.append((attrname, field, field.name, field.default,
+                          python_type))
+        d['_fields_items'] = items = tuple(items)
+        if '_init_fields' not in d:
+            if generic:
+                d['_init_fields'] = Schema._init_fields.im_func
+            else:
+                d['_init_fields'] = _generate_init_fields(items)
         return type.__new__(cls, name, bases, d)
 
+# Implementations of `__set__` that only convert the value to JSON and store
+# it (the cache being empty on initialization)
+_standard_setters = (_implementation(Field, '__set__'),
+                     _implementation(_CachedField, '__set__'))
+
+# Implementations of `__get__` that return the plain default value of a field
+# when the data has no value for it
+_standard_getters = (_implementation(Field, '__get__'),
+                     _implementation(_RequiredField, '__get__'),
+                     _implementation(_CachedField, '__get__'))
+
+
+def _generate_init_fields(items):
+    """Generate a version of `Schema._init_fields` specialized for the given
+    fields, with the loop over the fields unrolled and the conversion of every
+    field inlined.
+    
+    This only works for fields using the standard `__get__` and `__set__`
+    implementations, as it inlines the default handling and conversion done
+    by those.
+    """
+    lines = ['def _init_fields(self, values):',
+             '    data = self._data',
+             '    pop = values.pop']
+    namespace = {'DEFAULT': DEFAULT}
+    for idx, (attrname, field, name, default, python_type) in enumerate(items):
+        namespace['_type%d' % idx] = python_type
+        namespace['_to_json%d' % idx] = field._json
+        namespace['_default%d' % idx] = default
+        if callable(default):
+            lines.append('    value = pop(%r, DEFAULT)' % attrname)
+            lines.append('    if value is DEFAULT:')
+            lines.append('        value = _default%d()' % idx)
+        else:
+            lines.append('    value = pop(%r, _default%d)' % (attrname, idx))
+        lines.append('    if value is not None and type(value) is not _type%d:'
+                     % idx)
+        lines.append('        value = _to_json%d(value)' % idx)
+        lines.append('    data[%r] = value' % name)
+    exec '\n'.join(lines) in namespace
+    return namespace['_init_fields']
+
 
 class Schema(object):
     __metaclass__ = SchemaMeta
+    __slots__ = ('_data', '_cache')
 
     def __init__(self, **values):
         self._data = {}
-        for attrname, field in self._fields.items():
+        self._cache = {}
+        self._init_fields(values)
+
+    def _init_fields(self, values):
+        # Generic initialization of the fields, only used when the schema has
+        # fields that can not be handled by `_generate_init_fields`
+        data = self._data
+        for attrname, field, name, default, python_type in self._fields_items:
             if attrname in values:
-                setattr(self, attrname, values.pop(attrname))
+                value = values.pop(attrname)
+                if type(value) is python_type:
+                    data[name] = value
+                else:
+                    setattr(self, attrname, value)
+            elif default is None:
+                data[name] = None
             else:
                 setattr(self, attrname, getattr(self, attrname))
 
@@ -138,18 +329,44 @@ class Schema(object):
         return iter(self._data)
 
     def __len__(self):
-        return len(self._data or ())
+        return len(self._data)
 
     def __delitem__(self, name):
+        self._cache.pop(name, None)
         del self._data[name]
 
     def __getitem__(self, name):
         return self._data[name]
 
     def __setitem__(self, name, value):
+        self._cache.pop(name, None)
         self._data[name] = value
 
+    def __getstate__(self):
+        # The data is stored in a slot, so it needs to be added to the state
+        # explicitly for pickling; subclasses may still have a __dict__
+        state = getattr(self, '__dict__', {}).copy()
+        state['_data'] = self._data
+        return state
+
+    def __setstate__(self, state):
+        state = state.copy()
+        self._data = state.pop('_data')
+        self._cache = {}
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def unwrap(self):
+        """Return the underlying JSON data of this schema instance.
+        
+        Values converted from fields of this instance are cached, and that
+        cache is cleared here, so that the data can be modified in place.
+        Changes made later through a reference to the data that was kept
+        around are only seen after the next call to this method.
+        
+        :return: the data dictionary
+        """
+        self._cache.clear()
         return self._data
 
     def build(cls, **d):
@@ -163,8 +380,13 @@ class Schema(object):
     build = classmethod(build)
 
     def wrap(cls, data):
-        instance = cls()
+        if getattr(cls.__init__, 'im_func', None) in _plain_inits:
+            # Nothing else to initialize, so skip populating the fields
+            instance = object.__new__(cls)
+        else:
+            instance = cls()
         instance._data = data
+        instance._cache = {}
         return instance
     wrap = classmethod(wrap)
 
@@ -229,20 +451,28 @@ class View(object):
         self.language = language
         self.wrapper = wrapper
         self.defaults = defaults
+        self._cache = WeakKeyDictionary()
 
     def __get__(self, instance, cls=None):
+        view = self._cache.get(cls)
+        if view is not None:
+            return view
         if self.wrapper is DEFAULT:
+            wrap = cls.wrap
             def wrapper(row):
-                if row.doc is not None:
-                    return cls.wrap(row.doc)
+                doc = row.doc
+                if doc is not None:
+                    return wrap(doc)
                 data = row.value
                 data['_id'] = row.id
-                return cls.wrap(data)
+                return wrap(data)
         else:
             wrapper = self.wrapper
-        return ViewDefinition(self.design, self.name, self.map_fun,
+        view = ViewDefinition(self.design, self.name, self.map_fun,
                               self.reduce_fun, language=self.language,
                               wrapper=wrapper, **self.defaults)
+        self._cache[cls] = view
+        return view
 
 
 class DocumentMeta(SchemaMeta):
@@ -257,30 +487,29 @@ class DocumentMeta(SchemaMeta):
 
 class Document(Schema):
     __metaclass__ = DocumentMeta
+    __slots__ = ()
 
     def __init__(self, id=None, **values):
         Schema.__init__(self, **values)
         if id is not None:
-            self.id = id
+            self._data['_id'] = id
 
     def __repr__(self):
-        return '<%s %r@%r %r>' % (type(self).__name__, self.id, self.rev,
-                                  dict([(k, v) for k, v in self._data.items()
+        data = self._data
+        return '<%s %r@%r %r>' % (type(self).__name__, data.get('_id'),
+                                  data.get('_rev'),
+                                  dict([(k, v) for k, v in data.items()
                                         if k not in ('_id', '_rev')]))
 
     def _get_id(self):
-        if hasattr(self._data, 'id'): # When data is client.Document
-            return self._data.id
         return self._data.get('_id')
     def _set_id(self, value):
-        if self.id is not None:
+        if self._data.get('_id') is not None:
             raise AttributeError('id can only be set on new documents')
         self._data['_id'] = value
     id = property(_get_id, _set_id)
 
     def rev(self):
-        if hasattr(self._data, 'rev'): # When data is client.Document
-            return self._data.rev
         return self._data.get('_rev')
     rev = property(rev)
 
@@ -300,15 +529,14 @@ class Document(Schema):
         
         :return: a list of ``(name, value)`` tuples
         """
-        retval = []
-        if self.id is not None:
-            retval.append(('_id', self.id))
-            if self.rev is not None:
-                retval.append(('_rev', self.rev))
-        for name, value in self._data.items():
-            if name not in ('_id', '_rev'):
-                retval.append((name, value))
-        return retval
+        data = self._data
+        if data.get('_id') is None:
+            return [(name, value) for name, value in data.items()
+                    if name not in ('_id', '_rev')]
+        elif data.get('_rev', DEFAULT) is None:
+            return [(name, value) for name, value in data.items()
+                    if name != '_rev']
+        return data.items()
 
     def load(cls, db, id):
         """Load a specific document from the given database.
@@ -326,11 +554,13 @@ class Document(Schema):
 
     def store(self, db):
         """Store the document in the given database."""
-        if self.id is None:
+        docid = self._data.get('_id')
+        if docid is None:
             docid = db.create(self._data)
             self._data = db.get(docid)
+            self._cache.clear()
         else:
-            db[self.id] = self._data
+            db[docid] = self._data
         return self
 
     def query(cls, db, map_fun, reduce_fun, language='javascript',
@@ -345,16 +575,8 @@ class Document(Schema):
         this will initiate a new HTTP request for every document, unless the
         `include_docs` option is explitly specified.
         """
-        def _wrapper(row):
-            if eager:
-                if row.doc is not None:
-                    return row.doc
-                return cls.load(db, row.id)
-            data = row.value
-            data['_id'] = row.id
-            return cls.wrap(data)
         return db.query(map_fun, reduce_fun=reduce_fun, language=language,
-                        wrapper=_wrapper, **options)
+                        wrapper=cls._row_wrapper(db, eager), **options)
     query = classmethod(query)
 
     def view(cls, db, viewname, eager=False, **options):
@@ -368,45 +590,67 @@ class Document(Schema):
         this will initiate a new HTTP request for every document, unless the
         `include_docs` option is explitly specified.
         """
-        def _wrapper(row):
-            if eager:
-                if row.doc is not None:
-                    return row.doc
-                return cls.load(db, row.id)
-            data = row.value
-            data['_id'] = row.id
-            return cls.wrap(data)
-        return db.view(viewname, wrapper=_wrapper, **options)
+        return db.view(viewname, wrapper=cls._row_wrapper(db, eager),
+                       **options)
     view = classmethod(view)
 
+    def _row_wrapper(cls, db, eager):
+        """Return the function used by `query()` and `view()` to map result
+        rows to instances of this class.
+        """
+        if eager:
+            def _wrapper(row):
+                doc = row.doc
+                if doc is not None:
+                    return doc
+                return cls.load(db, row.id)
+        else:
+            wrap = cls.wrap
+            def _wrapper(row):
+                data = row.value
+                data['_id'] = row.id
+                return wrap(data)
+        return _wrapper
+    _row_wrapper = classmethod(_row_wrapper)
+
+# Implementations of `__init__` that `Schema.wrap()` does not need to call
+_plain_inits = (Schema.__init__.im_func, Document.__init__.im_func)
+
 
 class TextField(Field):
     """Schema field for string values."""
-    _to_python = unicode
+    __slots__ = ()
+    _python_type = _to_python = unicode
 
 
 class FloatField(Field):
     """Schema field for float values."""
-    _to_python = float
+    __slots__ = ()
+    _python_type = _to_python = float
 
 
 class IntegerField(Field):
     """Schema field for integer values."""
-    _to_python = int
+    __slots__ = ()
+    _python_type = _to_python = int
 
 
 class LongField(Field):
     """Schema field for long integer values."""
-    _to_python = long
+    __slots__ = ()
+    _python_type = _to_python = long
 
 
 class BooleanField(Field):
     """Schema field for boolean values."""
-    _to_python = bool
+    __slots__ = ()
+    _python_type = _to_python = bool
 
 
 class DecimalField(Field):
     """Schema field for decimal values."""
+    __slots__ = ()
+    _cached = True
 
     def _to_python(self, value):
         return Decimal(value)
@@ -426,19 +670,23 @@ class DateField(Field):
     >>> field._to_json(datetime(2007, 4, 1, 15, 30))
     '2007-04-01'
     """
+    __slots__ = ()
+    _cached = True
 
     def _to_python(self, value):
         if isinstance(value, basestring):
             try:
-                value = date(*strptime(value, '%Y-%m-%d')[:3])
-            except ValueError, e:
+                if _ISO_DATE.match(value):
+                    value = date(int(value[0:4]), int(value[5:7]),
+                                 int(value[8:10]))
+                else:
+                    value = date(*strptime(value, '%Y-%m-%d')[:3])
+            except ValueError:
                 raise ValueError('Invalid ISO date %r' % value)
         return value
 
     def _to_json(self, value):
-        if isinstance(value, datetime):
-            value = value.date()
-        return value.isoformat()
+        return '%04d-%02d-%02d' % (value.year, value.month, value.day)
 
 
 class DateTimeField(Field):
@@ -452,15 +700,22 @@ class DateTimeField(Field):
     >>> field._to_json(date(2007, 4, 1))
     '2007-04-01T00:00:00Z'
     """
+    __slots__ = ()
+    _cached = True
 
     def _to_python(self, value):
         if isinstance(value, basestring):
             try:
                 value = value.split('.', 1)[0] # strip out microseconds
                 value = value.rstrip('Z') # remove timezone separator
-                timestamp = timegm(strptime(value, '%Y-%m-%dT%H:%M:%S'))
-                value = datetime.utcfromtimestamp(timestamp)
-            except ValueError, e:
+                if _ISO_DATETIME.match(value):
+                    value = datetime(int(value[0:4]), int(value[5:7]),
+                                     int(value[8:10]), int(value[11:13]),
+                                     int(value[14:16]), int(value[17:19]))
+                else:
+                    timestamp = timegm(strptime(value, '%Y-%m-%dT%H:%M:%S'))
+                    value = datetime.utcfromtimestamp(timestamp)
+            except ValueError:
                 raise ValueError('Invalid ISO date/time %r' % value)
         return value
 
@@ -468,8 +723,11 @@ class DateTimeField(Field):
         if isinstance(value, struct_time):
             value = datetime.utcfromtimestamp(timegm(value))
         elif not isinstance(value, datetime):
-            value = datetime.combine(value, time(0))
-        return value.replace(microsecond=0).isoformat() + 'Z'
+            return '%04d-%02d-%02dT00:00:00Z' % (value.year, value.month,
+                                                 value.day)
+        return '%04d-%02d-%02dT%02d:%02d:%02dZ' % (value.year, value.month,
+                                                   value.day, value.hour,
+                                                   value.minute, value.second)
 
 
 class TimeField(Field):
@@ -483,20 +741,24 @@ class TimeField(Field):
     >>> field._to_json(datetime(2007, 4, 1, 15, 30))
     '15:30:00'
     """
+    __slots__ = ()
+    _cached = True
 
     def _to_python(self, value):
         if isinstance(value, basestring):
             try:
                 value = value.split('.', 1)[0] # strip out microseconds
-                value = time(*strptime(value, '%H:%M:%S')[3:6])
-            except ValueError, e:
+                if _ISO_TIME.match(value):
+                    value = time(int(value[0:2]), int(value[3:5]),
+                                 int(value[6:8]))
+                else:
+                    value = time(*strptime(value, '%H:%M:%S')[3:6])
+            except ValueError:
                 raise ValueError('Invalid ISO time %r' % value)
         return value
 
     def _to_json(self, value):
-        if isinstance(value, datetime):
-            value = value.time()
-        return value.replace(microsecond=0).isoformat()
+        return '%02d:%02d:%02d' % (value.hour, value.minute, value.second)
 
 
 class DictField(Field):
@@ -526,6 +788,9 @@ class DictField(Field):
 
     >>> del server['python-tests']
     """
+    __slots__ = ('schema',)
+    _cached = True
+
     def __init__(self, schema, name=None, default=None):
         Field.__init__(self, name=name, default=default or {})
         self.schema = schema
@@ -574,6 +839,8 @@ class ListField(Field):
 
     >>> del server['python-tests']
     """
+    __slots__ = ('field',)
+    _cached = True
 
     def __init__(self, field, name=None, default=None):
         Field.__init__(self, name=name, default=default or [])
@@ -582,16 +849,24 @@ class ListField(Field):
                 field = field()
             elif issubclass(field, Schema):
                 field = DictField(field)
+        if not hasattr(field, '_json'):
+            field._bind_converters()
         self.field = field
+        if type(field) in (IntegerField, BooleanField):
+            # JSON integers and booleans need no conversion when read, so the
+            # list can be returned as is instead of being wrapped in a proxy
+            # (unlike floats and longs, which JSON may encode as plain ints)
+            self._py = lambda value: value
 
     def _to_python(self, value):
         return self.Proxy(value, self.field)
 
     def _to_json(self, value):
-        return [self.field._to_json(item) for item in value]
+        return map(self.field._json, value)
 
 
     class Proxy(list):
+        __slots__ = ('list', 'field')
 
         def __init__(self, list, field):
             self.list = list
@@ -628,14 +903,15 @@ class ListField(Field):
             del self.list[index]
 
         def __getitem__(self, index):
-            return self.field._to_python(self.list[index])
+            return self.field._py(self.list[index])
 
         def __setitem__(self, index, value):
-            self.list[index] = self.field._to_json(item)
+            self.list[index] = self.field._json(value)
 
         def __iter__(self):
-            for index in range(len(self)):
-                yield self[index]
+            to_python = self.field._py
+            for item in self.list:
+                yield to_python(item)
 
         def __len__(self):
             return len(self.list)
@@ -649,7 +925,7 @@ class ListField(Field):
                 value = args[0]
             else:
                 value = kwargs
-            value = self.field._to_json(value)
+            value = self.field._json(value)
             self.list.append(value)
 
         def extend(self, list):
@@ -6,13 +6,20 @@
 # This software is licensed as described in the file COPYING, which
 # you should have received as part of this distribution.
 
+from datetime import date, datetime, time
 import doctest
 import os
+import pickle
 import unittest
 
 from couchdb import client, schema
 
 
+class PickledPost(schema.Document):
+    title = schema.TextField()
+    added = schema.DateField()
+
+
 class DocumentTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -75,6 +82,321 @@ class DocumentTestCase(unittest.TestCase):
         self.assertEqual(dict, type(results[1]))
 
 
+class SchemaTestCase(unittest.TestCase):
+
+    def test_init_defaults(self):
+        class Post(schema.Document):
+            title = schema.TextField()
+            author = schema.TextField(default='anonymous')
+            tags = schema.ListField(schema.TextField())
+        post = Post(title='Foo bar')
+        self.assertEqual({'title': u'Foo bar', 'author': u'anonymous',
+                          'tags': []}, post.unwrap())
+
+    def test_init_missing_field(self):
+        class Post(schema.Document):
+            title = schema.TextField()
+        post = Post()
+        self.assertEqual({'title': None}, post.unwrap())
+        self.assertEqual(None, post.title)
+
+    def test_wrap(self):
+        class Post(schema.Document):
+            title = schema.TextField()
+            author = schema.TextField(default='anonymous')
+        data = {'_id': 'foo_bar', 'title': 'Foo bar'}
+        post = Post.wrap(data)
+        self.assertEqual('foo_bar', post.id)
+        self.assertEqual(u'Foo bar', post.title)
+        self.assertEqual(u'anonymous', post.author)
+        assert post.unwrap() is data
+        self.assertEqual({'_id': 'foo_bar', 'title': 'Foo bar'}, data)
+
+    def test_wrap_custom_init(self):
+        class Post(schema.Document):
+            title = schema.TextField()
+            def __init__(self, *args, **kwargs):
+                schema.Document.__init__(self, *args, **kwargs)
+                self.seen = []
+        data = {'_id': 'foo_bar', 'title': 'Foo bar'}
+        post = Post.wrap(data)
+        self.assertEqual([], post.seen)
+        assert post.unwrap() is data
+        self.assertEqual(u'Foo bar', post.title)
+
+    def test_slots(self):
+        class Post(schema.Document):
+            __slots__ = ()
+            title = schema.TextField()
+        post = Post(title='Foo bar')
+        assert not hasattr(post, '__dict__')
+        assert not hasattr(Post.title, '__dict__')
+        self.assertRaises(AttributeError, setattr, post, 'foo', 'bar')
+
+    def test_field_without_default(self):
+        class Post(schema.Document):
+            title = schema.TextField()
+            author = schema.TextField(default='anonymous')
+        assert isinstance(Post.title, schema.TextField)
+        assert type(Post.title) is not schema.TextField
+        assert type(Post.author) is schema.TextField
+        post = Post.wrap({'title': 'Foo bar'})
+        self.assertEqual(u'Foo bar', post.title)
+        self.assertEqual(u'anonymous', post.author)
+        self.assertEqual(None, Post.wrap({}).title)
+
+    def test_native_values_passed_through(self):
+        class Post(schema.Document):
+            title = schema.TextField()
+            rating = schema.FloatField()
+            count = schema.IntegerField(default=0)
+        title = u'Foo bar'
+        post = Post(title=title, rating=3, count='5')
+        assert post.unwrap()['title'] is title
+        self.assertEqual(float, type(post.unwrap()['rating']))
+        self.assertEqual(int, type(post.unwrap()['count']))
+        post.rating = 4.5
+        self.assertEqual(4.5, post.rating)
+        self.assertEqual(5, post.count)
+
+    def test_items(self):
+        class Post(schema.Document):
+            title = schema.TextField()
+        post = Post(title='Foo bar')
+        self.assertEqual([('title', u'Foo bar')], post.items())
+        post = Post.wrap({'_id': 'foo_bar', '_rev': '1', 'title': 'Foo bar'})
+        self.assertEqual([('_id', 'foo_bar'), ('_rev', '1'),
+                          ('title', 'Foo bar')], sorted(post.items()))
+
+    def test_items_without_id_or_rev(self):
+        class Post(schema.Document):
+            title = schema.TextField()
+        post = Post(title='Foo bar')
+        post.id = None
+        self.assertEqual([('title', u'Foo bar')], post.items())
+        post = Post.wrap({'_id': 'foo_bar', '_rev': None, 'title': 'Foo bar'})
+        self.assertEqual([('_id', 'foo_bar'), ('title', 'Foo bar')],
+                         sorted(post.items()))
+
+    def test_id_and_rev_of_client_document(self):
+        class Post(schema.Document):
+            title = schema.TextField()
+        post = Post.wrap(client.Document(_id='foo_bar', _rev='1'))
+        self.assertEqual('foo_bar', post.id)
+        self.assertEqual('1', post.rev)
+        post = Post.wrap(client.Document(title='Foo bar'))
+        self.assertEqual(None, post.id)
+        self.assertEqual(None, post.rev)
+
+    def test_init_custom_setter(self):
+        class UpperTextField(schema.TextField):
+            def __set__(self, instance, value):
+                schema.TextField.__set__(self, instance, value.upper())
+        class Post(schema.Document):
+            title = UpperTextField()
+        post = Post(title=u'Foo bar')
+        self.assertEqual(u'FOO BAR', post.unwrap()['title'])
+
+    def test_init_generated(self):
+        class Post(schema.Document):
+            title = schema.TextField()
+            rating = schema.FloatField(default=0)
+            added = schema.DateField(default=lambda: date(2008, 1, 1))
+            tags = schema.ListField(schema.TextField())
+        class Article(Post):
+            subtitle = schema.TextField(name='sub')
+        post = Post(title='Foo bar', tags=['foo'], extra='ignored')
+        self.assertEqual({'title': u'Foo bar', 'rating': 0.0,
+                          'added': '2008-01-01', 'tags': [u'foo']},
+                         post.unwrap())
+        self.assertEqual(float, type(post.unwrap()['rating']))
+        article = Article(id='foo', subtitle='Bar', added=None)
+        self.assertEqual({'_id': 'foo', 'title': None, 'sub': u'Bar',
+                          'rating': 0.0, 'added': None, 'tags': []},
+                         article.unwrap())
+
+    def test_field_names_interned(self):
+        class Post(schema.Document):
+            title = schema.TextField(name=''.join(['ti', 'tle']))
+            content = schema.TextField()
+        assert Post.title.name is intern('title')
+        assert Post.content.name is intern('content')
+
+    def test_inherited_fields(self):
+        class Post(schema.Document):
+            title = schema.TextField()
+        class Tagged(schema.Schema):
+            tags = schema.ListField(schema.TextField())
+        class Article(Post):
+            subtitle = schema.TextField()
+        class TaggedArticle(Article, Tagged):
+            title = schema.TextField(default='untitled')
+        self.assertEqual(['subtitle', 'title'], sorted(Article._fields))
+        self.assertEqual(['subtitle', 'tags', 'title'],
+                         sorted(TaggedArticle._fields))
+        assert TaggedArticle._fields['title'] is TaggedArticle.title
+        self.assertEqual(['title'], Post._fields.keys())
+
+    def test_converted_values_cached(self):
+        class Post(schema.Document):
+            title = schema.TextField()
+            added = schema.DateTimeField()
+            author = schema.DictField(schema.Schema.build(
+                name = schema.TextField()
+            ))
+        post = Post.wrap({'title': 'Foo bar', 'added': '2007-04-01T15:30:00Z',
+                          'author': {'name': 'John Doe'}})
+        assert post.added is post.added
+        assert post.author is post.author
+        post.author.name = 'Jane Doe'
+        self.assertEqual({'name': u'Jane Doe'}, post.unwrap()['author'])
+        post.added = datetime(2008, 1, 1)
+        self.assertEqual(datetime(2008, 1, 1), post.added)
+        post['added'] = '2009-01-01T00:00:00Z'
+        self.assertEqual(datetime(2009, 1, 1), post.added)
+        del post['added']
+        self.assertEqual(None, post.added)
+
+    def test_unwrap_clears_cache(self):
+        class Post(schema.Document):
+            added = schema.DateTimeField()
+        post = Post.wrap({'added': '2007-04-01T15:30:00Z'})
+        self.assertEqual(datetime(2007, 4, 1, 15, 30), post.added)
+        post.unwrap()['added'] = '2008-01-01T00:00:00Z'
+        self.assertEqual(datetime(2008, 1, 1), post.added)
+
+    def test_builtin_converters(self):
+        class StrField(schema.Field):
+            _to_python = unicode
+            _to_json = str
+        class Post(schema.Document):
+            title = StrField()
+            tags = schema.ListField(StrField())
+        post = Post(title=u'Foo bar', tags=[u'foo'])
+        self.assertEqual({'title': 'Foo bar', 'tags': ['foo']}, post.unwrap())
+        self.assertEqual(str, type(post.unwrap()['title']))
+        self.assertEqual(u'Foo bar', post.title)
+        self.assertEqual(unicode, type(post.title))
+
+    def test_pickle(self):
+        post = PickledPost(id='foo_bar', title='Foo bar',
+                           added=date(2008, 1, 1))
+        post.extra = 'extra'
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(post, protocol))
+            self.assertEqual(post.unwrap(), copy.unwrap())
+            self.assertEqual('foo_bar', copy.id)
+            self.assertEqual(date(2008, 1, 1), copy.added)
+            self.assertEqual('extra', copy.extra)
+        post = PickledPost.wrap({})
+        copy = pickle.loads(pickle.dumps(post, 0))
+        self.assertEqual({}, copy.unwrap())
+
+    def test_field_without_base_init(self):
+        class UpperField(schema.Field):
+            def __init__(self, name=None):
+                self.name = name
+                self.default = None
+            def _to_json(self, value):
+                return unicode(value).upper()
+        class Post(schema.Document):
+            title = UpperField()
+            tags = schema.ListField(UpperField())
+        post = Post(title='Foo bar', tags=['foo'])
+        self.assertEqual({'title': u'FOO BAR', 'tags': [u'FOO']},
+                         post.unwrap())
+        self.assertEqual(u'FOO BAR', post.title)
+
+    def test_init_custom_getter(self):
+        class ComputedField(schema.TextField):
+            def __get__(self, instance, owner):
+                if instance is None:
+                    return self
+                value = instance._data.get(self.name)
+                if value is None:
+                    value = u'computed'
+                return value
+        class Post(schema.Schema):
+            title = ComputedField(default='default')
+        self.assertEqual({'title': u'computed'}, Post().unwrap())
+
+
+class DateTimeFieldTestCase(unittest.TestCase):
+
+    def test_date_to_python(self):
+        field = schema.DateField()
+        self.assertEqual(date(2008, 2, 29), field._to_python(u'2008-02-29'))
+        self.assertEqual(date(2007, 4, 1), field._to_python('2007-4-1'))
+        for value in ('2007-02-29', '2007/04/01', '2007-04-01Z', '2007-+4-01',
+                      '2007- 4-01', u'\uff12\uff10\uff10\uff17-04-01',
+                      '2007-04-01\n'):
+            self.assertRaises(ValueError, field._to_python, value)
+
+    def test_datetime_to_python(self):
+        field = schema.DateTimeField()
+        self.assertEqual(datetime(2007, 4, 1, 15, 30, 5),
+                         field._to_python(u'2007-04-01T15:30:05Z'))
+        self.assertEqual(datetime(2007, 4, 1, 15, 30, 5),
+                         field._to_python('2007-04-01T15:30:05.123Z'))
+        self.assertEqual(datetime(2007, 4, 1, 1, 2, 3),
+                         field._to_python('2007-4-1T1:2:3Z'))
+        self.assertEqual(datetime(2008, 12, 31, 23, 59, 59),
+                         field._to_python('2008-12-31T23:59:59Z'))
+        self.assertEqual(datetime(2009, 1, 1, 0, 0, 0),
+                         field._to_python('2008-12-31T23:59:60Z'))
+        for value in ('2007-04-01', '2007-04-01 15:30:05',
+                      '2007-04-01T25:30:05', '2007-04-01T15:30:05+02:00',
+                      '2007-04-01T15:+3:05'):
+            self.assertRaises(ValueError, field._to_python, value)
+
+    def test_time_to_python(self):
+        field = schema.TimeField()
+        self.assertEqual(time(15, 30, 5), field._to_python(u'15:30:05'))
+        self.assertEqual(time(15, 30, 5), field._to_python('15:30:05.123'))
+        self.assertEqual(time(1, 2, 3), field._to_python('1:2:3'))
+        for value in ('15:30', '15-30-05', '15:61:05', '15:-3:05'):
+            self.assertRaises(ValueError, field._to_python, value)
+
+    def test_to_json(self):
+        self.assertEqual('0999-01-02', schema.DateField()._to_json(
+            date(999, 1, 2)))
+        field = schema.DateTimeField()
+        self.assertEqual('0999-01-02T03:04:05Z',
+                         field._to_json(datetime(999, 1, 2, 3, 4, 5, 678)))
+        self.assertEqual('2007-04-01T15:30:05Z', field._to_json(
+            datetime(2007, 4, 1, 15, 30, 5).utctimetuple()))
+        self.assertEqual('03:04:05', schema.TimeField()._to_json(
+            time(3, 4, 5, 678)))
+
+
+class ViewTestCase(unittest.TestCase):
+
+    def test_view_definition_cached(self):
+        class Person(schema.Document):
+            name = schema.TextField()
+            by_name = schema.View('people', 'function(doc) {}')
+        class Employee(Person):
+            pass
+        self.assertEqual('by_name', Person.by_name.name)
+        assert Person.by_name is Person.by_name
+        assert Person().by_name is Person.by_name
+        assert Employee.by_name is not Person.by_name
+
+    def test_view_wrapper(self):
+        class Person(schema.Document):
+            name = schema.TextField()
+            by_name = schema.View('people', 'function(doc) {}')
+        row = client.Row(id='foo', key='Foo', value={'name': 'Foo'})
+        person = Person.by_name.wrapper(row)
+        self.assertEqual(Person, type(person))
+        self.assertEqual('foo', person.id)
+        self.assertEqual(u'Foo', person.name)
+        row = client.Row(id='foo', key='Foo', value=None,
+                         doc={'_id': 'foo', 'name': 'Bar'})
+        person = Person.by_name.wrapper(row)
+        self.assertEqual(u'Bar', person.name)
+
+
 class ListFieldTestCase(unittest.TestCase):
 
     def test_to_json(self):
@@ -91,11 +413,53 @@ class ListFieldTestCase(unittest.TestCase):
         self.assertEqual([{'content': 'Bla bla', 'author': 'myself'}],
                          post.comments)
 
+    def test_scalar_items(self):
+        class Post(schema.Document):
+            ratings = schema.ListField(schema.IntegerField())
+        post = Post(ratings=['1', 2, 3.0])
+        self.assertEqual([1, 2, 3], post.unwrap()['ratings'])
+        self.assertEqual([int, int, int],
+                         [type(item) for item in post.unwrap()['ratings']])
+
+    def test_scalar_items_not_proxied(self):
+        class Post(schema.Document):
+            ratings = schema.ListField(schema.IntegerField())
+        post = Post.wrap({'ratings': [1, 2]})
+        assert post.ratings is post.unwrap()['ratings']
+        post.ratings.append(3)
+        self.assertEqual([1, 2, 3], post.unwrap()['ratings'])
+
+    def test_float_items_from_json_integers(self):
+        class Post(schema.Document):
+            ratings = schema.ListField(schema.FloatField())
+            views = schema.ListField(schema.LongField())
+        post = Post.wrap({'ratings': [1, 2.5], 'views': [1, 2]})
+        self.assertEqual([float, float],
+                         [type(item) for item in post.ratings])
+        self.assertEqual([long, long], [type(item) for item in post.views])
+
+    def test_setitem(self):
+        class Post(schema.Document):
+            dates = schema.ListField(schema.DateField())
+        post = Post(dates=[date(2008, 1, 1)])
+        post.dates[0] = date(2008, 2, 29)
+        self.assertEqual(['2008-02-29'], post.unwrap()['dates'])
+
+    def test_iter(self):
+        class Post(schema.Document):
+            dates = schema.ListField(schema.DateField())
+        post = Post.wrap({'dates': ['2008-01-01', '2008-02-29']})
+        self.assertEqual([date(2008, 1, 1), date(2008, 2, 29)],
+                         list(post.dates))
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(doctest.DocTestSuite(schema))
     suite.addTest(unittest.makeSuite(DocumentTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(SchemaTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(DateTimeFieldTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ViewTestCase, 'test'))
     suite.addTest(unittest.makeSuite(ListFieldTestCase, 'test'))
     return suite
 